@@ -1,3 +1,4 @@
+import orjson
 import os
 import pandas as pd
 import streamlit as st
@@ -12,6 +13,7 @@ from langchain.prompts.chat import ChatPromptTemplate, HumanMessagePromptTemplat
 from langsmith import Client, RunTree, traceable
 from mitreattack.stix20 import MitreAttackData
 from openai import AzureOpenAI
+from stix2 import MemoryStore
 
 
 # ------------------ Streamlit UI Configuration ------------------ #
@@ -78,7 +80,10 @@ st.set_page_config(
 # Load and cache the MITRE ATT&CK data
 @st.cache_resource
 def load_attack_data():
-    attack_data = MitreAttackData("./data/enterprise-attack.json")
+    # Parse the STIX bundle with orjson, which is considerably faster than the standard library for a file this size
+    with open("./data/enterprise-attack.json", "rb") as f:
+        stix_bundle = orjson.loads(f.read())
+    attack_data = MitreAttackData(src=MemoryStore(stix_data=stix_bundle["objects"]))
     return attack_data
 
 attack_data = load_attack_data()
@@ -498,7 +503,7 @@ try:
                 st.info("Please select a threat group with associated Enterprise ATT&CK techniques.")
             else:
                 response = generate_scenario_azure_wrapper(messages)
-                st.markdown("---")
+                st.divider()
                 if response is not None:
                     st.session_state['scenario_generated'] = True
                     scenario_text = response.choices[0].message.content
@@ -512,7 +517,7 @@ try:
                 else:
                     # If a scenario has been generated previously, display it
                     if 'scenario_text' in st.session_state and st.session_state['scenario_generated']:
-                        st.markdown("---")
+                        st.divider()
                         st.markdown(st.session_state['scenario_text'])
                         st.download_button(label="Download Scenario", data=st.session_state['scenario_text'], file_name="threat_group_scenario.md", mime="text/markdown")
 
@@ -532,7 +537,7 @@ try:
                 google_api_key = st.session_state.get('google_api_key')
                 model_name = os.getenv('GOOGLE_MODEL')
                 response = generate_scenario_google_wrapper(google_api_key, model_name, messages)
-                st.markdown("---")
+                st.divider()
                 if response is not None:
                     st.session_state['scenario_generated'] = True
                     scenario_text = response.content
@@ -546,7 +551,7 @@ try:
                 else:
                     # If a scenario has been generated previously, display it
                     if 'scenario_text' in st.session_state and st.session_state['scenario_generated']:
-                        st.markdown("---")
+                        st.divider()
                         st.markdown(st.session_state['scenario_text'])
                         st.download_button(label="Download Scenario", data=st.session_state['scenario_text'], file_name="threat_group_scenario.md", mime="text/markdown")
 
@@ -566,7 +571,7 @@ try:
                 mistral_api_key = st.session_state.get('mistral_api_key')
                 model_name = os.getenv('MISTRAL_MODEL')
                 response = generate_scenario_mistral_wrapper(mistral_api_key, model_name, messages)
-                st.markdown("---")
+                st.divider()
                 if response is not None:
                     st.session_state['scenario_generated'] = True
                     scenario_text = response.content
@@ -580,7 +585,7 @@ try:
                 else:
                     # If a scenario has been generated previously, display it
                     if 'scenario_text' in st.session_state and st.session_state['scenario_generated']:
-                        st.markdown("---")
+                        st.divider()
                         st.markdown(st.session_state['scenario_text'])
                         st.download_button(label="Download Scenario", data=st.session_state['scenario_text'], file_name="threat_group_scenario.md", mime="text/markdown")
     
@@ -597,7 +602,7 @@ try:
             else:
                 model = os.getenv('OLLAMA_MODEL')
                 response = generate_scenario_ollama_wrapper(model)
-                st.markdown("---")
+                st.divider()
                 if response is not None:
                     st.session_state['scenario_generated'] = True
                     scenario_text = response
@@ -611,7 +616,7 @@ try:
                 else:
                     # If a scenario has been generated previously, display it
                     if 'scenario_text' in st.session_state and st.session_state['scenario_generated']:
-                        st.markdown("---")
+                        st.divider()
                         st.markdown(st.session_state['scenario_text'])
                         st.download_button(label="Download Scenario", data=st.session_state['scenario_text'], file_name="threat_group_scenario.md", mime="text/markdown")
 
@@ -631,7 +636,7 @@ try:
                 st.info("Please select a threat group with associated Enterprise ATT&CK techniques.")
             else:
                 response = generate_scenario_wrapper(openai_api_key, model_name, messages)
-                st.markdown("---")
+                st.divider()
                 if response is not None:
                     st.session_state['scenario_generated'] = True
                     scenario_text = response.generations[0][0].text
@@ -645,7 +650,7 @@ try:
                 else:
                     # If a scenario has been generated previously, display it
                     if 'scenario_text' in st.session_state and st.session_state['scenario_generated']:
-                        st.markdown("---")
+                        st.divider()
                         st.markdown(st.session_state['scenario_text'])
                         st.download_button(label="Download Scenario", data=st.session_state['scenario_text'], file_name="threat_group_scenario.md", mime="text/markdown")
     
@@ -657,7 +662,7 @@ try:
     feedback_placeholder = st.empty()
 
     # Show the thumbs_up and thumbs_down buttons only when a scenario has been generated
-    st.markdown("---")
+    st.divider()
     # Show the feedback buttons only if a scenario has been generated and the LangSmith client is initialized
     if st.session_state.get('scenario_generated', False) and client is not None:
         st.markdown("Rate the scenario to help improve this tool.")
@@ -1,17 +1,29 @@
+import asyncio
+import diskcache
+import functools
+import hashlib
+import inspect
+import json
+import nh3
 import os
 import pandas as pd
 import streamlit as st
+import threading
+import time
+import uuid
+import weakref
 
+from concurrent.futures import ThreadPoolExecutor
 from langchain.callbacks.manager import collect_runs
-from langchain_community.llms import Ollama
 from langchain_core.messages import HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI 
-from langchain_mistralai.chat_models import ChatMistralAI
-from langchain_openai import ChatOpenAI
 from langchain.prompts.chat import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
-from langsmith import Client, RunTree, traceable
-from mitreattack.stix20 import MitreAttackData
-from openai import AzureOpenAI
+from markdown_it import MarkdownIt
+from tenacity import AsyncRetrying, retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from types import MappingProxyType
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from langsmith import RunTree
 
 
 # ------------------ Streamlit UI Configuration ------------------ #
@@ -21,17 +33,18 @@ os.environ["LANGCHAIN_TRACING_V2"]="true"
 os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
 os.environ["LANGCHAIN_PROJECT"] = "AttackGen"
 
-# Initialise the LangSmith client if an API key is available
-api_key = os.getenv('LANGSMITH_API_KEY')    
+# Get the LangSmith API key if one is available, preferring the LangChain API key secret
+api_key = st.secrets.get("LANGCHAIN_API_KEY") or os.getenv('LANGSMITH_API_KEY')
 
-client = Client(api_key=api_key) if api_key else None
+# Initialise the LangSmith client once per API key and reuse it across reruns and sessions
+@st.cache_resource
+def get_langsmith_client(api_key):
+    from langsmith import Client
+    return Client(api_key=api_key)
 
-# Initialise the LangChain client conditionally based on the presence of the secret
-if "LANGCHAIN_API_KEY" in st.secrets:
-    langchain_api_key = st.secrets["LANGCHAIN_API_KEY"]
-    client = Client(api_key=langchain_api_key)
-else:
-    client = None
+# Get the LangSmith client, only creating it when tracing or feedback first needs it
+def get_client():
+    return get_langsmith_client(api_key) if api_key else None
 
 # Add environment variables from session state for Azure OpenAI Service
 if "AZURE_OPENAI_API_KEY" in st.session_state:
@@ -58,6 +71,7 @@ if "mistral_model" in st.session_state:
 # Add environment variables from session state for Ollama
 if "ollama_model" in st.session_state:
     os.environ["OLLAMA_MODEL"] = st.session_state["ollama_model"]
+OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', '')  # Read once per run, after the session's model has been applied
 
 # Get the model provider and other required session state variables
 model_provider = st.session_state["chosen_model_provider"]
@@ -74,50 +88,40 @@ st.set_page_config(
 )
 
 # ------------------ Incident Response Templates ------------------ #
-incident_response_templates = {
-    "Phishing Attack": ["Spearphishing Attachment (T1193)", "User Execution (T1204)", "Browser Extensions (T1176)", "Credentials from Password Stores (T1555)", "Input Capture (T1056)", "Exfiltration Over C2 Channel (T1041)"],
-    "Ransomware Attack": ["Exploit Public-Facing Application (T1190)", "Windows Management Instrumentation (T1047)", "Create Account (T1136)", "Process Injection (T1055)", "Data Encrypted for Impact (T1486)"],
-    "Malware Infection": ["Supply Chain Compromise (T1195)", "Command and Scripting Interpreter (T1059)", "Registry Run Keys / Startup Folder (T1060)", "Obfuscated Files or Information (T1027)", "Remote Services (T1021)", "Data Destruction (T1485)"],
-    "Insider Threat": ["Valid Accounts (T1078)", "Account Manipulation (T1098)", "Exploitation for Privilege Escalation (T1068)", "Data Staged (T1074)", "Scheduled Transfer (T1029)", "Account Access Removal (T1531)"],
-    "Supply Chain Compromise": ["Supply Chain Compromise (T0862)", "Command-Line Interface (T0807)", "Modify Program (T0889)", "Exploitation for Privilege Escalation (T0890)", "Lateral Tool Transfer (T0867)", "Automated Collection (T0802)", "Connection Proxy (T0884)", "Block Command Message (T0803)", "Denial of Control (T0813)", "Damage to Property (T0879)"],
-    "Spearphishing Attack on ICS Systems": ["Spearphishing Attachment (T0865)", "User Execution (T0863)", "System Firmware (T0857)", "Hooking (T0874)", "Remote Services (T0886)", "Data from Information Repositories (T0811)", "Standard Application Layer Protocol (T0869)", "Modify Alarm Settings (T0838)", "Loss of Control (T0813)"],
-    "Malware Infection through Removable Media": ["Replication Through Removable Media (T0847)", "Scripting (T0853)", "Project File Infection (T0873)", "Exploitation for Privilege Escalation (T0890)", "Lateral Tool Transfer (T0867)", "Monitor Process State (T0801)", "Standard Application Layer Protocol (T0869)", "Data Destruction (T0809)", "Loss of Productivity and Revenue (T0828)"],
-    "Ransomware Attack on ICS Systems": ["Exploit Public-Facing Application (T0819)", "Command-Line Interface (T0807)", "Modify Program (T0889)", "Exploitation for Privilege Escalation (T0890)", "Remote Services (T0886)", "Data from Local System (T0893)", "Standard Application Layer Protocol (T0869)", "Data Destruction (T0809)", "Denial of Control (T0813)", "Denial of View (T0815)"]
-}
-
-# ------------------ Helper Functions ------------------ #
 
-# Load and cache the MITRE ATT&CK data
+# Load and cache the incident response templates as a read-only mapping of ordered ATT&CK technique ID tuples
 @st.cache_resource
-def load_attack_data():
-    # Load the enterprise attack data
-    enterprise_attack_data = MitreAttackData("./data/enterprise-attack.json")
-    # Load the ICS attack data
-    ics_attack_data = MitreAttackData("./data/ics-attack.json")
-    # Combine both Enterprise and ICS techniques into a single object
-    attack_data = enterprise_attack_data.get_techniques() + ics_attack_data.get_techniques()
-    return attack_data
+def load_incident_response_templates():
+    templates = {
+        "Phishing Attack": ["T1193", "T1204", "T1176", "T1555", "T1056", "T1041"],
+        "Ransomware Attack": ["T1190", "T1047", "T1136", "T1055", "T1486"],
+        "Malware Infection": ["T1195", "T1059", "T1060", "T1027", "T1021", "T1485"],
+        "Insider Threat": ["T1078", "T1098", "T1068", "T1074", "T1029", "T1531"],
+        "Supply Chain Compromise": ["T0862", "T0807", "T0889", "T0890", "T0867", "T0802", "T0884", "T0803", "T0813", "T0879"],
+        "Spearphishing Attack on ICS Systems": ["T0865", "T0863", "T0857", "T0874", "T0886", "T0811", "T0869", "T0838", "T0827"],
+        "Malware Infection through Removable Media": ["T0847", "T0853", "T0873", "T0890", "T0867", "T0801", "T0869", "T0809", "T0828"],
+        "Ransomware Attack on ICS Systems": ["T0819", "T0807", "T0889", "T0890", "T0886", "T0893", "T0869", "T0809", "T0813", "T0815"]
+    }
+    return MappingProxyType({name: tuple(techniques) for name, techniques in templates.items()})
+
+incident_response_templates = load_incident_response_templates()
+
+# ------------------ Helper Functions ------------------ #
 
-attack_data = load_attack_data()
+# Path to the minimal techniques index built from the MITRE ATT&CK STIX data by scripts/build_techniques_index.py
+TECHNIQUES_INDEX_PATH = "./data/techniques_min.json"
 
 # Get all techniques
 @st.cache_resource
 def load_techniques():
     try:
-        # Load combined attack data
-        attack_data = load_attack_data()
-        # Process all techniques into a unified list
-        techniques_list = []
-        for technique in attack_data:
-            for reference in technique.external_references:
-                if "external_id" in reference:
-                    techniques_list.append({
-                        'id': technique.id,
-                        'Technique Name': technique.name,
-                        'External ID': reference['external_id'],
-                        'Display Name': f"{technique.name} ({reference['external_id']})"
-                    })
-        techniques_df = pd.DataFrame(techniques_list)
+        import orjson
+
+        # Load the pre-extracted techniques, one record per external reference
+        with open(TECHNIQUES_INDEX_PATH, "rb") as f:
+            techniques_df = pd.DataFrame(orjson.loads(f.read()), columns=['id', 'Technique Name', 'External ID', 'Display Name'])
+        # Store the columns used for lookups as categoricals to speed up comparisons
+        techniques_df = techniques_df.astype({'External ID': 'category', 'Display Name': 'category'})
         
         return techniques_df
     except Exception as e:
@@ -126,244 +130,613 @@ def load_techniques():
 
 techniques_df = load_techniques()
 
+# Get the sorted technique display names shown in the multiselect
+@st.cache_data(show_spinner=False)
+def load_display_names():
+    techniques_df = load_techniques()
+    if techniques_df.empty:
+        return []
+    return sorted(techniques_df['Display Name'].unique())
+
+display_names = load_display_names()
+
+# Map ATT&CK technique IDs to their display names for constant-time lookups
+@st.cache_resource
+def load_techniques_by_id():
+    techniques_df = load_techniques()
+    if techniques_df.empty:
+        return {}
+    return dict(zip(techniques_df['External ID'], techniques_df['Display Name']))
+
+techniques_by_id = load_techniques_by_id()
+
+# Close a session's HTTP client and event loop on a separate thread, as the garbage collector may run this while another loop is running
+def close_session_loop(loop, resources):
+    def close():
+        http_client = resources.get("http_client")
+        if http_client is not None:
+            loop.run_until_complete(http_client.aclose())
+        loop.close()
+    threading.Thread(target=close, daemon=True).start()
+
+# Hold a session's event loop and the async resources bound to it, closing them once the session's state is discarded
+class SessionLoop:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.resources = {}
+        weakref.finalize(self, close_session_loop, self.loop, self.resources)
+
+# Get the session's event loop holder, creating it on first use
+def get_session_loop():
+    if "event_loop" not in st.session_state:
+        st.session_state["event_loop"] = SessionLoop()
+    return st.session_state["event_loop"]
+
+# Run a coroutine on the session's event loop so that cached async clients can reuse their connections
+def run_async(coro):
+    return get_session_loop().loop.run_until_complete(coro)
+
+# Get an LLM client from the session's cache, creating it on first use
+def get_llm_client(factory, *key, api_key=None):
+    # Key the cache on a hash of the API key to avoid holding the plaintext key in the cache key
+    api_key_hash = hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+    llm_clients = st.session_state.setdefault("llm_clients", {})
+    cache_key = (*key, api_key_hash)
+    if cache_key not in llm_clients:
+        llm_clients[cache_key] = factory()
+    return llm_clients[cache_key]
+
+# Get the session's HTTP client, shared by the OpenAI and Azure OpenAI clients to reuse keep-alive HTTP/2 connections
+# The client is bound to the session's event loop, so it is closed along with it
+def get_http_client():
+    resources = get_session_loop().resources
+    if "http_client" not in resources:
+        import httpx
+        resources["http_client"] = httpx.AsyncClient(http2=True,
+                                                     timeout=60,
+                                                     limits=httpx.Limits(max_keepalive_connections=20, max_connections=100))
+    return resources["http_client"]
+
+# Get the LLM client for each model provider, importing its SDK on first use
+# The OpenAI clients' own retries are disabled, as LLM_RETRY_POLICY already retries their transient errors
+def get_openai_llm(openai_api_key, model_name):
+    from langchain_openai import ChatOpenAI
+    return get_llm_client(lambda: ChatOpenAI(openai_api_key=openai_api_key, model_name=model_name, streaming=True, max_retries=0, http_async_client=get_http_client()), "openai", model_name, api_key=openai_api_key)
+
+def get_azure_llm(azure_api_key, azure_api_endpoint, azure_api_version):
+    from openai import AsyncAzureOpenAI
+    return get_llm_client(lambda: AsyncAzureOpenAI(api_key=azure_api_key,
+                                                   azure_endpoint=azure_api_endpoint,
+                                                   api_version=azure_api_version,
+                                                   max_retries=0,
+                                                   http_client=get_http_client()),
+                          "azure", azure_api_endpoint, azure_api_version, api_key=azure_api_key)
+
+def get_google_llm(google_api_key, model):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return get_llm_client(lambda: ChatGoogleGenerativeAI(google_api_key=google_api_key, model=model), "google", model, api_key=google_api_key)
+
+def get_mistral_llm(mistral_api_key):
+    from langchain_mistralai.chat_models import ChatMistralAI
+    return get_llm_client(lambda: ChatMistralAI(mistral_api_key=mistral_api_key), "mistral", api_key=mistral_api_key)
+
+def get_ollama_llm(model):
+    from langchain_community.llms import Ollama
+    return get_llm_client(lambda: Ollama(model=model), "ollama", model)
+
+# Convert LangChain message objects to the format expected by the Azure OpenAI Service, replacing 'human' with 'user'
+def format_azure_messages(messages):
+    return [{"role": "user" if message.type == "human" else message.type, "content": message.content} for message in messages]
+
+# Retry only transient errors, i.e. timeouts, rate limits and temporarily unavailable services
+def is_transient_error(e):
+    from openai import APITimeoutError, RateLimitError
+    if isinstance(e, (APITimeoutError, RateLimitError)):
+        return True
+    response = getattr(e, "response", None)
+    return getattr(response, "status_code", None) in (429, 503)
+
+# Wait for as long as the provider's Retry-After header asks, falling back to exponential backoff with jitter
+def wait_retry_after(retry_state):
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    try:
+        return min(float(response.headers["retry-after"]), 60)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return wait_exponential_jitter(initial=1, max=30)(retry_state)
+
+LLM_RETRY_POLICY = dict(wait=wait_retry_after, stop=stop_after_attempt(5), retry=retry_if_exception(is_transient_error), reraise=True)
+llm_retry = retry(**LLM_RETRY_POLICY)
+
+# Render a streamed scenario into a placeholder as it is generated and return the full text, restarting the stream on transient errors
+async def stream_scenario(open_stream, chunk_text):
+    st.divider()
+    placeholder = st.empty()
+    async for attempt in AsyncRetrying(**LLM_RETRY_POLICY):
+        with attempt:
+            scenario_text = ""
+            rendered_length, last_render = 0, time.monotonic()
+            chunks = open_stream()
+            if inspect.isawaitable(chunks):
+                chunks = await chunks
+            async for chunk in chunks:
+                scenario_text += chunk_text(chunk)
+                # Re-render at most every 100ms or 200 characters, as each render re-parses the whole scenario
+                if time.monotonic() - last_render > 0.1 or len(scenario_text) - rendered_length > 200:
+                    placeholder.markdown(scenario_text)
+                    rendered_length, last_render = len(scenario_text), time.monotonic()
+    # Always render the complete scenario once streaming has finished
+    placeholder.markdown(scenario_text)
+    return scenario_text
+
+# Apply LangSmith tracing to a generator only when a LangSmith client is available, checked when the generator is called
+def maybe_traceable(name, tags):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if (client := get_client()) is not None:
+                from langsmith import traceable
+                return traceable(run_type="llm", name=name, tags=tags, client=client)(func)(*args, **kwargs)
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
 def generate_scenario_wrapper(openai_api_key, model_name, messages):
-    if client is not None:  # If LangChain client has been initialized
-        @traceable(run_type="llm", name="Custom Scenario", tags=["openai", "custom_scenario"], client=client)
-        def generate_scenario(openai_api_key, model_name, messages, *, run_tree: RunTree):
-            model_name = st.session_state["model_name"]
-            try:
-                with st.status('Generating scenario...', expanded=True):
-                    st.write("Initialising AI model.")
-                    llm = ChatOpenAI(openai_api_key=openai_api_key, model_name=model_name, streaming=False)
-                    st.write("Model initialised. Generating scenario, please wait.")
-                    response = llm.generate(messages=[messages])
-                    st.write("Scenario generated successfully.")
-                    st.session_state['run_id'] = str(run_tree.id)  # Store the run ID in the session state
-                    return response
-            except Exception as e:
-                st.error("An error occurred while generating the scenario: " + str(e))
-                st.session_state['run_id'] = str(run_tree.id)  # Ensure run_id is updated even on failure
-                return None
-    else:  # If LangChain client has not been initialized
-        def generate_scenario(openai_api_key, model_name, messages):
-            model_name = st.session_state["model_name"]
-            try:
-                with st.status('Generating scenario...', expanded=True):
-                    st.write("Initialising AI model.")
-                    llm = ChatOpenAI(openai_api_key=openai_api_key, model_name=model_name, streaming=False)
-                    st.write("Model initialised. Generating scenario, please wait.")
-                    response = llm.generate(messages=[messages])
-                    st.write("Scenario generated successfully.")
-                    return response
-            except Exception as e:
-                st.error("An error occurred while generating the scenario: " + str(e))
-                return None
-    
-    return generate_scenario(openai_api_key, model_name, messages)
+    @maybe_traceable("Custom Scenario", ["openai", "custom_scenario"])
+    async def generate_scenario(openai_api_key, model_name, messages, *, run_tree: "RunTree" = None):
+        try:
+            with st.status('Generating scenario...', expanded=True):
+                st.write("Initialising AI model.")
+                llm = get_openai_llm(openai_api_key, model_name)
+                st.write("Model initialised. Generating scenario below.")
+            response = await stream_scenario(lambda: llm.astream(messages), lambda chunk: chunk.content)
+            return response
+        except Exception as e:
+            st.error("An error occurred while generating the scenario: " + str(e))
+            return None
+        finally:
+            if run_tree is not None:
+                st.session_state['run_id'] = str(run_tree.id)  # Store the run ID in the session state, even on failure
+
+    return run_async(generate_scenario(openai_api_key, model_name, messages))
 
 def generate_scenario_azure_wrapper(messages):
-    if client is not None:  # LangSmith client has been initialised
-        @traceable(run_type="llm", name="Custom Scenario (Azure OpenAI)", tags=["azure", "custom_scenario"], client=client if client is not None else None)
-        def generate_scenario_azure(messages, *, run_tree: RunTree):
-            try:
-                azure_api_key = os.getenv('AZURE_OPENAI_API_KEY')
-                azure_api_endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
-                azure_deployment_name = os.getenv('AZURE_DEPLOYMENT')
-                azure_api_version = os.getenv('OPENAI_API_VERSION')
-                with st.status('Generating scenario...', expanded=True):
-                    st.write("Initialising AI model.")
-                    llm = AzureOpenAI(api_key=azure_api_key,
-                                      azure_endpoint=azure_api_endpoint,
-                                      api_version=azure_api_version)
-                    st.write("Model initialised. Generating scenario, please wait.")
-                    
-                    # Convert message objects to the expected format
-                    formatted_messages = []
-                    for message in messages:
-                        if hasattr(message, 'role') and hasattr(message, 'content'):
-                            role = message.role
-                            if role == 'human':
-                                role = 'user'  # Replace 'human' with 'user'
-                            formatted_messages.append({"role": role, "content": message.content})
-                        elif hasattr(message, 'type') and hasattr(message, 'content'):
-                            role = message.type
-                            if role == 'human':
-                                role = 'user'  # Replace 'human' with 'user'
-                            formatted_messages.append({"role": role, "content": message.content})
-                        else:
-                            raise ValueError(f"Unsupported message format: {message}")
-                    
-                    response = llm.chat.completions.create(
-                        model=azure_deployment_name,
-                        messages=formatted_messages
-                    )
-                    st.write("Scenario generated successfully.")
-                    st.session_state['run_id'] = str(run_tree.id)  # Store the run ID in the session state
-                    return response
-            except Exception as e:
-                st.error(f"An error occurred while generating the scenario: {str(e)}")
-                st.session_state['run_id'] = str(run_tree.id)  # Ensure run_id is updated even on failure
-                return None
-    else:  # LangSmith client has not been initialised
-        def generate_scenario_azure(messages):
-            try:
-                azure_api_key = os.getenv('AZURE_OPENAI_API_KEY')
-                azure_api_endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
-                azure_deployment_name = os.getenv('AZURE_DEPLOYMENT')
-                azure_api_version = os.getenv('OPENAI_API_VERSION')
-                with st.status('Generating scenario...', expanded=True):
-                    st.write("Initialising AI model.")
-                    llm = AzureOpenAI(api_key=azure_api_key,
-                                      azure_endpoint=azure_api_endpoint,
-                                      api_version=azure_api_version)
-                    st.write("Model initialised. Generating scenario, please wait.")
-                    
-                    # Convert message objects to the expected format
-                    formatted_messages = []
-                    for message in messages:
-                        if hasattr(message, 'role') and hasattr(message, 'content'):
-                            role = message.role
-                            if role == 'human':
-                                role = 'user'  # Replace 'human' with 'user'
-                            formatted_messages.append({"role": role, "content": message.content})
-                        elif hasattr(message, 'type') and hasattr(message, 'content'):
-                            role = message.type
-                            if role == 'human':
-                                role = 'user'  # Replace 'human' with 'user'
-                            formatted_messages.append({"role": role, "content": message.content})
-                        else:
-                            raise ValueError(f"Unsupported message format: {message}")
-                    
-                    response = llm.chat.completions.create(
-                        model=azure_deployment_name,
-                        messages=formatted_messages
-                    )
-                    st.write("Scenario generated successfully.")
-                    return response
-            except Exception as e:
-                st.error(f"An error occurred while generating the scenario: {str(e)}")
-                return None
-    return generate_scenario_azure(messages)
+    @maybe_traceable("Custom Scenario (Azure OpenAI)", ["azure", "custom_scenario"])
+    async def generate_scenario_azure(messages, *, run_tree: "RunTree" = None):
+        try:
+            azure_api_key = os.getenv('AZURE_OPENAI_API_KEY')
+            azure_api_endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
+            azure_deployment_name = os.getenv('AZURE_DEPLOYMENT')
+            azure_api_version = os.getenv('OPENAI_API_VERSION')
+            with st.status('Generating scenario...', expanded=True):
+                st.write("Initialising AI model.")
+                llm = get_azure_llm(azure_api_key, azure_api_endpoint, azure_api_version)
+                st.write("Model initialised. Generating scenario below.")
+            open_stream = lambda: llm.chat.completions.create(
+                model=azure_deployment_name,
+                messages=format_azure_messages(messages),
+                stream=True
+            )
+            response = await stream_scenario(open_stream, lambda chunk: (chunk.choices[0].delta.content or "") if chunk.choices else "")
+            return response
+        except Exception as e:
+            st.error(f"An error occurred while generating the scenario: {str(e)}")
+            return None
+        finally:
+            if run_tree is not None:
+                st.session_state['run_id'] = str(run_tree.id)  # Store the run ID in the session state, even on failure
+
+    return run_async(generate_scenario_azure(messages))
 
 def generate_scenario_google_wrapper(google_api_key, model, messages):
-    if client is not None: # If LangSmith client has been initialised
-        @traceable(run_type="llm", name="Custom Scenario (Google AI API)", tags=["google", "custom_scenario"], client=client)
-        def generate_scenario_google(google_api_key, model, messages, *, run_tree: RunTree):
-            try:
-                google_api_key = os.getenv('GOOGLE_API_KEY')
-                model = os.getenv('GOOGLE_MODEL')
-                with st.status('Generating scenario...', expanded=True):
-                    st.write("Initialising AI model.")
-                    llm = ChatGoogleGenerativeAI(google_api_key=google_api_key, model=model)
-                    st.write("Model initialised. Generating scenario, please wait.")
-                    response = llm.invoke(messages)
-                    st.write("Scenario generated successfully.")
-                    st.session_state['run_id'] = str(run_tree.id) # Store the run ID in the session state
-                    return response
-            except Exception as e:
-                st.error(f"An error occurred while generating the scenario: {str(e)}")
-                st.session_state['run_id'] = str(run_tree.id) # Ensure run_id is updated even on failure
-                return None
-    else: # If LangSmith client has not been initialised
-        def generate_scenario_google(google_api_key, model, messages):
+    @maybe_traceable("Custom Scenario (Google AI API)", ["google", "custom_scenario"])
+    async def generate_scenario_google(google_api_key, model, messages, *, run_tree: "RunTree" = None):
+        try:
+            with st.status('Generating scenario...', expanded=True):
+                st.write("Initialising AI model.")
+                llm = get_google_llm(google_api_key, model)
+                st.write("Model initialised. Generating scenario below.")
+            response = await stream_scenario(lambda: llm.astream(messages), lambda chunk: chunk.content)
+            return response
+        except Exception as e:
+            st.error(f"An error occurred while generating the scenario: {str(e)}")
+            return None
+        finally:
+            if run_tree is not None:
+                st.session_state['run_id'] = str(run_tree.id) # Store the run ID in the session state, even on failure
+
+    return run_async(generate_scenario_google(google_api_key, model, messages))
+
+def generate_scenario_mistral_wrapper(mistral_api_key, model, messages):
+    @maybe_traceable("Custom Scenario (Mistral API)", ["mistral", "custom_scenario"])
+    async def generate_scenario_mistral(mistral_api_key, model, messages, *, run_tree: "RunTree" = None):
+        try:
+            with st.status('Generating scenario...', expanded=True):
+                st.write("Initialising AI model.")
+                llm = get_mistral_llm(mistral_api_key)
+                st.write("Model initialised. Generating scenario below.")
+            response = await stream_scenario(lambda: llm.astream(messages, model=model), lambda chunk: chunk.content)
+            return response
+        except Exception as e:
+            st.error(f"An error occurred while generating the scenario: {str(e)}")
+            return None
+        finally:
+            if run_tree is not None:
+                st.session_state['run_id'] = str(run_tree.id) # Store the run ID in the session state, even on failure
+
+    return run_async(generate_scenario_mistral(mistral_api_key, model, messages))
+
+def generate_scenario_ollama_wrapper(model, messages):
+    @maybe_traceable("Threat Group Scenario (Ollama)", ["ollama", "threat_group_scenario"])
+    async def generate_scenario_ollama(model, messages, *, run_tree: "RunTree" = None):
+        try:
+            with st.status('Generating scenario...', expanded=True):
+                st.write("Initialising AI model.")
+                llm = get_ollama_llm(model)
+                st.write("Model initialised. Generating scenario below.")
+            response = await stream_scenario(lambda: llm.astream(messages, model=model), lambda chunk: chunk)
+            return response
+        except Exception as e:
+            st.error(f"An error occurred while generating the scenario: {str(e)}")
+            return None
+        finally:
+            if run_tree is not None:
+                st.session_state['run_id'] = str(run_tree.id)  # Store the run ID in the session state, even on failure
+
+    return run_async(generate_scenario_ollama(model, messages))
+
+SCENARIO_CACHE_PATH = "./.cache/scenarios"
+SCENARIO_CACHE_TTL = 7 * 86400  # seconds
+
+# Get the on-disk cache of generated scenarios, keyed by a hash of the generation inputs, so they survive server restarts
+@st.cache_resource
+def get_scenario_cache():
+    return diskcache.Cache(SCENARIO_CACHE_PATH)
+
+# Build a stable key from the inputs that determine a generated scenario
+def build_state_key(*inputs):
+    return hashlib.blake2b(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+# Get the API key for the chosen model provider, or None if it doesn't need one
+def provider_api_key():
+    if model_provider == "Azure OpenAI Service":
+        return os.getenv('AZURE_OPENAI_API_KEY')
+    elif model_provider == "Google AI API":
+        return os.getenv('GOOGLE_API_KEY')
+    elif model_provider == "Mistral API":
+        return os.getenv('MISTRAL_API_KEY')
+    elif model_provider == "Ollama":
+        return None
+    else:
+        return st.session_state.get('openai_api_key')
+
+# Return a previously generated scenario for identical inputs, or generate and cache a new one
+# With regenerate set, the cached scenario is skipped and replaced by a newly generated one
+def generate_scenario_cached(model_name, messages, generate, regenerate=False):
+    scenario_cache = get_scenario_cache()
+    # Azure deployment names are only unique within an endpoint, so the endpoint is part of the key
+    endpoint = os.getenv('AZURE_OPENAI_ENDPOINT') if model_provider == "Azure OpenAI Service" else None
+    # Key on a hash of the API key too, so cached scenarios are only served to sessions using the key that generated them
+    api_key_hash = hashlib.sha256((provider_api_key() or "").encode()).hexdigest()[:16]
+    cache_key = build_state_key(model_provider, endpoint, api_key_hash, model_name, industry, company_size, [(message.type, message.content) for message in messages])
+    cached = None if regenerate else scenario_cache.get(cache_key)
+    if cached is not None:
+        # Keep the run ID only if this session generated the cached scenario itself, e.g. on a double-click
+        # Otherwise it may come from another user's run, so clear the run ID to hide feedback for it
+        if st.session_state.get('last_req_id') != cache_key:
+            st.session_state['run_id'] = None
+        store_scenario(cached)
+        st.divider()
+        show_stored_scenario()
+        st.session_state['last_req_id'] = cache_key
+        return cached
+    response = generate()
+    if response is not None:
+        scenario_cache.set(cache_key, response, expire=SCENARIO_CACHE_TTL)
+        store_scenario(response)
+        st.session_state['last_req_id'] = cache_key
+    return response
+
+# Generate a scenario's text with the chosen model provider without rendering it, so that several can be generated at once
+@maybe_traceable("Template Scenario", [model_provider, "template_scenario"])
+@llm_retry
+async def generate_scenario_text(messages):
+    if model_provider == "Azure OpenAI Service":
+        llm = get_azure_llm(os.getenv('AZURE_OPENAI_API_KEY'), os.getenv('AZURE_OPENAI_ENDPOINT'), os.getenv('OPENAI_API_VERSION'))
+        response = await llm.chat.completions.create(model=os.getenv('AZURE_DEPLOYMENT'), messages=format_azure_messages(messages))
+        return response.choices[0].message.content
+    elif model_provider == "Google AI API":
+        response = await get_google_llm(os.getenv('GOOGLE_API_KEY'), os.getenv('GOOGLE_MODEL')).ainvoke(messages)
+        return response.content
+    elif model_provider == "Mistral API":
+        response = await get_mistral_llm(os.getenv('MISTRAL_API_KEY')).ainvoke(messages, model=os.getenv('MISTRAL_MODEL'))
+        return response.content
+    elif model_provider == "Ollama":
+        return await get_ollama_llm(OLLAMA_MODEL).ainvoke(messages)
+    else:
+        response = await get_openai_llm(st.session_state.get('openai_api_key'), st.session_state.get('model_name')).ainvoke(messages)
+        return response.content
+
+# Generate scenarios concurrently, yielding (name, scenario_text, error) as each one completes
+async def generate_many(named_messages, max_concurrency=3):
+    # Limit the number of requests in flight to stay within the provider's rate limits
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def generate(name, messages):
+        async with semaphore:
             try:
-                google_api_key = os.getenv('GOOGLE_API_KEY')
-                model = os.getenv('GOOGLE_MODEL')
-                with st.status('Generating scenario...', expanded=True):
-                    st.write("Initialising AI model.")
-                    llm = ChatGoogleGenerativeAI(google_api_key=google_api_key, model=model)
-                    st.write("Model initialised. Generating scenario, please wait.")
-                    response = llm.invoke(messages)
-                    st.write("Scenario generated successfully.")
-                    return response
+                return name, await generate_scenario_text(messages), None
             except Exception as e:
-                st.error(f"An error occurred while generating the scenario: {str(e)}")
-                return None
-    
-    return generate_scenario_google(google_api_key, model, messages)
+                return name, None, e
 
-def generate_scenario_mistral_wrapper(mistral_api_key, model_name, messages):
-    if client is not None: # If LangSmith client has been initialised
-        @traceable(run_type="llm", name="Custom Scenario (Mistral API)", tags=["mistral", "custom_scenario"], client=client)
-        def generate_scenario_mistral(mistral_api_key, model_name, messages, *, run_tree: RunTree):
-            try:
-                mistral_api_key = os.getenv('MISTRAL_API_KEY')
-                model = os.getenv('MISTRAL_MODEL')
-                with st.status('Generating scenario...', expanded=True):
-                    st.write("Initialising AI model.")
-                    llm = ChatMistralAI(mistral_api_key=mistral_api_key)
-                    st.write("Model initialised. Generating scenario, please wait.")
-                    response = llm.invoke(messages, model=model)
-                    st.write("Scenario generated successfully.")
-                    st.session_state['run_id'] = str(run_tree.id) # Store the run ID in the session state
-                    return response
-            except Exception as e:
-                st.error(f"An error occurred while generating the scenario: {str(e)}")
-                st.session_state['run_id'] = str(run_tree.id) # Ensure run_id is updated even on failure
-                return None
-    else: # If LangSmith client has not been initialised
-        def generate_scenario_mistral(mistral_api_key, model_name, messages):
-            try:
-                mistral_api_key = os.getenv('MISTRAL_API_KEY')
-                model = os.getenv('MISTRAL_MODEL')
-                with st.status('Generating scenario...', expanded=True):
-                    st.write("Initialising AI model.")
-                    llm = ChatMistralAI(mistral_api_key=mistral_api_key)
-                    st.write("Model initialised. Generating scenario, please wait.")
-                    response = llm.invoke(messages, model=model)
-                    st.write("Scenario generated successfully.")
-                    return response
-            except Exception as e:
-                st.error(f"An error occurred while generating the scenario: {str(e)}")
-                return None
-    
-    return generate_scenario_mistral(mistral_api_key, model_name, messages)
+    tasks = [asyncio.ensure_future(generate(name, messages)) for name, messages in named_messages]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            yield await completed
+    finally:
+        # Cancel any generations still pending if the caller stops early, e.g. when a rerun interrupts it
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# Build and cache the custom scenario prompt template, so only formatting happens per request
+@st.cache_resource
+def load_chat_prompt():
+    # Create System Message Template
+    system_template = "You are a cybersecurity expert. Your task is to produce a comprehensive incident response testing scenario based on the information provided."
+    system_message_prompt = SystemMessagePromptTemplate.from_template(system_template)
 
-def generate_scenario_ollama_wrapper(model):
-    if client is not None: # If LangSmith client has been initialised
-        @traceable(run_type="llm", name="Threat Group Scenario (Ollama)", tags=["ollama", "threat_group_scenario"], client=client)
-        def generate_scenario_ollama(model, *, run_tree: RunTree):
-            try:
-                model = os.getenv('OLLAMA_MODEL')
-                with st.status('Generating scenario...', expanded=True):
-                    st.write("Initialising AI model.")
-                    llm = Ollama(model=model)
-                    st.write("Model initialised. Generating scenario, please wait.")
-                    response = llm.invoke(messages, model=model)
-                    st.write("Scenario generated successfully.")
-                    st.session_state['run_id'] = str(run_tree.id)  # Store the run ID in the session state
-                return response
-            except Exception as e:
-                st.error(f"An error occurred while generating the scenario: {str(e)}")
-                st.session_state['run_id'] = str(run_tree.id)  # Ensure run_id is updated even on failure
-                return None
-    else: # If LangSmith client has not been initialised
-        def generate_scenario_ollama(model):
-            try:
-                model = os.getenv('OLLAMA_MODEL')
-                with st.status('Generating scenario...', expanded=True):
-                    st.write("Initialising AI model.")
-                    llm = Ollama(model=model)
-                    st.write("Model initialised. Generating scenario, please wait.")
-                    response = llm.invoke(messages, model=model)
-                    st.write("Scenario generated successfully.")
-                return response
-            except Exception as e:
-                st.error(f"An error occurred while generating the scenario: {str(e)}")
-                return None
+    # Create Human Message Template
+    human_template = ("""
+**Background information:**
+The company operates in the '{industry}' industry and is of size '{company_size}'.
 
-    return generate_scenario_ollama(model)
+**Threat actor information:**
+{template_info}
+The threat actor is known to use the following ATT&CK techniques:
+{selected_techniques_string}
+
+**Your task:**
+Create a custom incident response testing scenario based on the information provided. The goal of the scenario is to test the company's incident response capabilities against a threat actor group that uses the identified ATT&CK techniques. 
+
+Your response should be well structured and formatted using Markdown.
+""")
+    human_message_prompt = HumanMessagePromptTemplate.from_template(human_template)
+
+    # Construct the ChatPromptTemplate
+    return ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
+
+chat_prompt = load_chat_prompt()
+
+# Build the prompt messages for a custom scenario from the selected techniques
+def build_scenario_messages(selected_techniques, template=""):
+    selected_techniques_string = '\n'.join(dict.fromkeys(selected_techniques))  # Drop duplicates, preserving order
+    template_info = f"This is a '{template}' scenario." if template else ""
+
+    # Format the prompt
+    return chat_prompt.format_prompt(selected_techniques_string=selected_techniques_string, 
+                                     industry=industry, 
+                                     company_size=company_size,
+                                     template_info=template_info).to_messages()
+
+# Resolve a template's technique IDs to unique display names, skipping any not in the loaded ATT&CK data
+def resolve_template_techniques(template):
+    return list(dict.fromkeys(techniques_by_id[tid] for tid in incident_response_templates[template] if tid in techniques_by_id))
+
+# Display a template scenario in its own expander with a download button
+def show_template_scenario(template, scenario_text):
+    with st.expander(template):
+        st.markdown(scenario_text)
+        st.download_button(label="Download Scenario", data=scenario_text, file_name=f"{template.lower().replace(' ', '_')}_scenario.md", mime="text/markdown", key=f"download_{template}")
+
+# Generate a scenario for each template, displaying each one as soon as it completes
+async def generate_template_scenarios(named_messages):
+    template_scenarios = {}
+    results = generate_many(named_messages)
+    try:
+        async for template, scenario_text, error in results:
+            if error is not None:
+                st.error(f"An error occurred while generating the '{template}' scenario: {str(error)}")
+            else:
+                template_scenarios[template] = scenario_text
+                show_template_scenario(template, scenario_text)
+    finally:
+        # Close the generator straight away, so its pending generations are cancelled rather than left on the session's loop
+        await results.aclose()
+    return template_scenarios
+
+# Split a scenario into its top-level markdown blocks, so each block renders as its own element
+# The split follows the parser's block boundaries, so lists with nested items or continuation paragraphs and fenced code stay whole
+def split_scenario_blocks(scenario_text):
+    lines = scenario_text.split("\n")
+    top_level_blocks = [token.map for token in load_markdown_renderer().parse(scenario_text) if token.level == 0 and token.map]
+    return ["\n".join(lines[start:end]) for start, end in top_level_blocks]
+
+# Build and cache a CommonMark renderer with the GFM tables and strikethrough that st.markdown supports
+# Raw HTML is left unrendered, as it is by st.markdown
+@st.cache_resource
+def load_markdown_renderer():
+    return MarkdownIt("commonmark", {"html": False}).enable(["table", "strikethrough"])
+
+# Allow the code block language classes produced by fenced code blocks, on top of nh3's default allow-list
+SCENARIO_HTML_ATTRIBUTES = {**nh3.ALLOWED_ATTRIBUTES, "code": {"class"}}
+
+# Render a scenario's markdown to sanitised HTML once, so reruns display it without parsing the markdown again
+def render_scenario_html(scenario_text):
+    return nh3.clean(load_markdown_renderer().render(scenario_text), attributes=SCENARIO_HTML_ATTRIBUTES)
+
+# Store a generated or cached scenario in the session state, with everything needed to display and download it on reruns
+def store_scenario(custom_scenario_text):
+    st.session_state['custom_scenario_generated'] = True
+    st.session_state['custom_scenario_text'] = custom_scenario_text  # Store the generated scenario in the session state
+    st.session_state['custom_scenario_html'] = [render_scenario_html(block) for block in split_scenario_blocks(custom_scenario_text)]  # Store each block's rendered HTML for display on reruns
+    st.session_state['custom_scenario_bytes'] = custom_scenario_text.encode('utf-8')  # Encode the download once, rather than on every rerun
+
+    st.session_state['last_scenario'] = True
+    st.session_state['last_scenario_text'] = custom_scenario_text # Store the last scenario in the session state for use by the Scenario Assistant
+
+# Display the stored scenario's pre-rendered HTML blocks, collapsing long scenarios into an expander
+def show_stored_scenario():
+    if len(st.session_state['custom_scenario_text']) > 5000:
+        with st.expander("Show scenario", expanded=False):
+            for block_html in st.session_state['custom_scenario_html']:
+                st.html(block_html)
+    else:
+        for block_html in st.session_state['custom_scenario_html']:
+            st.html(block_html)
 
 def template_selection(template):
     if template in incident_response_templates:
-        template_techniques = incident_response_templates[template]
-        # Filter techniques_df to get only those in the preset
-        filtered_techniques = techniques_df[techniques_df['Display Name'].isin(template_techniques)]
-        selected_techniques = filtered_techniques['Display Name'].tolist()
+        selected_techniques = resolve_template_techniques(template)
         # Update the session state directly
         st.session_state['selected_techniques'] = selected_techniques
 
 
+# Run LangSmith feedback submissions on background threads shared across sessions
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+# Build a callback that records a failed background feedback submission, to be displayed on the next rerun
+# The callback runs on a worker thread, so it appends to the session's error list rather than touching st.session_state
+def record_feedback_error(feedback_errors):
+    def callback(future):
+        if future.exception() is not None:
+            feedback_errors.append(str(future.exception()))
+    return callback
+
+# Render the feedback section as a fragment, so that clicking a feedback button only reruns this section
+@st.fragment
+def _feedback_ui(run_id, generated):
+    # Create a placeholder for the feedback message
+    feedback_placeholder = st.empty()
+
+    # Show any feedback submissions that failed in the background since the last rerun
+    feedback_errors = st.session_state.setdefault('feedback_errors', [])
+    while feedback_errors:
+        feedback_placeholder.error(f"An error occurred while creating feedback: {feedback_errors.pop(0)}")
+
+    # Show the thumbs_up and thumbs_down buttons only when a scenario has been generated in this session's own run
+    st.divider()
+    # Ensure the condition checks if 'custom_scenario_generated' is True, the run is known and client is initialized
+    if generated and run_id and (client := get_client()) is not None:
+        st.markdown("Rate the scenario to help improve this tool.")
+        col1, col2, col3 = st.columns([0.5, 0.5, 5])
+        with col1:
+            thumbs_up = st.button("👍", key="thumbs_up_custom")
+            if thumbs_up:
+                try:
+                    if run_id:
+                        feedback_type_str = "positive"
+                        score = 1  # or 0
+                        comment = ""
+
+                        # Record the feedback in the background, so the button returns without waiting for LangSmith
+                        feedback_id = uuid.uuid4()
+                        future = get_executor().submit(
+                            client.create_feedback,
+                            run_id,
+                            feedback_type_str,
+                            score=score,
+                            comment=comment,
+                            feedback_id=feedback_id,
+                        )
+                        future.add_done_callback(record_feedback_error(feedback_errors))
+                        st.session_state.feedback = {
+                            "feedback_id": str(feedback_id),
+                            "score": score,
+                        }
+                        # Update the feedback message in the placeholder
+                        feedback_placeholder.success("Feedback submitted. Thank you.")
+                    else:
+                        # Update the feedback message in the placeholder
+                        feedback_placeholder.warning("No run ID found. Please generate a scenario first.")
+                except Exception as e:
+                    # Update the feedback message in the placeholder
+                    feedback_placeholder.error(f"An error occurred while creating feedback: {str(e)}")
+
+        with col2:
+            thumbs_down = st.button("👎", key="thumbs_down_custom")
+            if thumbs_down:
+                try:
+                    if run_id:
+                        feedback_type_str = "negative"
+                        score = 0  # or 0
+                        comment = ""
+
+                        # Record the feedback in the background, so the button returns without waiting for LangSmith
+                        feedback_id = uuid.uuid4()
+                        future = get_executor().submit(
+                            client.create_feedback,
+                            run_id,
+                            feedback_type_str,
+                            score=score,
+                            comment=comment,
+                            feedback_id=feedback_id,
+                        )
+                        future.add_done_callback(record_feedback_error(feedback_errors))
+                        st.session_state.feedback = {
+                            "feedback_id": str(feedback_id),
+                            "score": score,
+                        }
+                        # Update the feedback message in the placeholder
+                        feedback_placeholder.success("Feedback submitted. Thank you.")
+                    else:
+                        # Update the feedback message in the placeholder
+                        feedback_placeholder.warning("No run ID found. Please generate a scenario first.")
+                except Exception as e:
+                    # Update the feedback message in the placeholder
+                    feedback_placeholder.error(f"An error occurred while creating feedback: {str(e)}")
+
+# Get the required settings for the chosen model provider, as (value, message) pairs where the message is shown if the value is missing
+def provider_settings():
+    if model_provider == "Azure OpenAI Service":
+        return [(os.getenv('AZURE_OPENAI_API_KEY'), "Please add your Azure OpenAI Service API key to continue."),
+                (os.getenv('AZURE_OPENAI_ENDPOINT'), "Please add your Azure OpenAI Service API endpoint to continue."),
+                (os.getenv('AZURE_DEPLOYMENT'), "Please add the name of your Azure OpenAI Service Deployment to continue.")]
+    elif model_provider == "Google AI API":
+        return [(os.getenv('GOOGLE_API_KEY'), "Please add your Google AI API key to continue."),
+                (os.getenv('GOOGLE_MODEL'), "Please select a model to continue.")]
+    elif model_provider == "Mistral API":
+        return [(os.getenv('MISTRAL_API_KEY'), "Please add your Mistral API key to continue."),
+                (os.getenv('MISTRAL_MODEL'), "Please select a model to continue.")]
+    elif model_provider == "Ollama":
+        return [(OLLAMA_MODEL, "Please select a model to continue.")]
+    else:
+        return [(st.session_state.get('openai_api_key'), "Please add your OpenAI API key to continue."),
+                (st.session_state.get('model_name'), "Please select a model to continue.")]
+
+# Show a message for each missing provider setting or company detail, returning whether generation can go ahead
+def validate_generation_inputs(settings):
+    missing = [message for value, message in settings if not value]
+    for message in missing:
+        st.info(message)
+    if missing:
+        return False
+    if not industry:
+        st.info("Please select your company's industry to continue.")
+        return False
+    if not company_size:
+        st.info("Please select your company's size to continue.")
+        return False
+    return True
+
+# Render the Generate Scenario button and its result for the chosen model provider
+def render_generate_flow(key, model_name, generate):
+    regenerate = st.checkbox("Regenerate", key=f"{key}_regenerate", help="Generate a new scenario even if one has already been generated for the same inputs.")
+    if st.button('Generate Scenario', key=key):
+        if validate_generation_inputs(provider_settings()):
+            response = generate_scenario_cached(model_name, messages, generate, regenerate)
+            if response is not None:
+                st.download_button(label="Download Scenario", data=st.session_state['custom_scenario_bytes'], file_name="custom_scenario.md", mime="text/markdown", key="download_custom_scenario")
+    else:
+        # If a scenario has been generated previously, display it
+        if 'custom_scenario_text' in st.session_state and st.session_state['custom_scenario_generated']:
+            st.divider()
+            show_stored_scenario()
+            data_bytes = st.session_state.setdefault('custom_scenario_bytes', st.session_state['custom_scenario_text'].encode('utf-8'))
+            st.download_button(label="Download Scenario", data=data_bytes, file_name="custom_scenario.md", mime="text/markdown", key="download_custom_scenario")
+
+
 # ------------------ Streamlit UI ------------------ #
     
 
@@ -373,70 +746,50 @@ st.markdown("""
             ### Select ATT&CK Techniques
             """)
 
-with st.expander("Use a Template (Optional)"):
-    st.markdown("""
-                Select a template to quickly generate a custom scenario based on a predefined set of ATT&CK techniques.
+# Run the technique selection as a fragment, so that interacting with its widgets only reruns this section
+@st.fragment
+def technique_selector():
+    with st.expander("Use a Template (Optional)"):
+        st.markdown("""
+                    Select a template to quickly generate a custom scenario based on a predefined set of ATT&CK techniques.
+                    """)
+
+        # Dropdown for selecting the incident response template
+        selected_template = st.selectbox(
+            "Select a template",
+            options=[""] + list(incident_response_templates.keys()),  # Add an empty option for no selection
+            format_func=lambda x: "Select a template" if x == "" else x  # Display placeholder text
+        )
+
+        # Automatically update selected techniques when a template is chosen
+        if selected_template:
+            template_selection(selected_template)
+    st.markdown("")
+    st.markdown(""" 
+                Use the multi-select box below to add or update the ATT&CK techniques that you would like to include in a custom incident response testing scenario.
                 """)
 
-    # Dropdown for selecting the incident response template
-    selected_template = st.selectbox(
-        "Select a template",
-        options=[""] + list(incident_response_templates.keys()),  # Add an empty option for no selection
-        format_func=lambda x: "Select a template" if x == "" else x  # Display placeholder text
-    )
-
-    # Automatically update selected techniques when a template is chosen
-    if selected_template:
-        template_selection(selected_template)
-st.markdown("")
-st.markdown(""" 
-            Use the multi-select box below to add or update the ATT&CK techniques that you would like to include in a custom incident response testing scenario.
-            """)
-
-selected_techniques = []
-if not techniques_df.empty:
-    selected_techniques = st.multiselect(
-        "Select ATT&CK techniques for the scenario",
-        sorted(techniques_df['Display Name'].unique()),
-        default=st.session_state.get('selected_techniques', []), 
-        placeholder="Select Techniques", 
-        label_visibility="hidden")
-    st.info("📝 Techniques are searchable by either their name or technique ID (e.g. `T1556` or `Phishing`).")
+    selected_techniques = []
+    if not techniques_df.empty:
+        selected_techniques = st.multiselect(
+            "Select ATT&CK techniques for the scenario",
+            display_names,
+            default=st.session_state.get('selected_techniques', []), 
+            placeholder="Select Techniques", 
+            label_visibility="hidden")
+        st.info("📝 Techniques are searchable by either their name or technique ID (e.g. `T1556` or `Phishing`).")
+
+    # Store the selections for use when the scenario prompt is assembled
+    st.session_state['selected_template'] = selected_template
+    st.session_state['scenario_techniques'] = selected_techniques
+
+technique_selector()
+selected_template = st.session_state.get('selected_template', "")
+selected_techniques = st.session_state.get('scenario_techniques', [])
     
 try:
     if len(selected_techniques) > 0:
-        selected_techniques_string = '\n'.join(selected_techniques)
-        template_info = f"This is a '{selected_template}' scenario." if selected_template else ""
-
-        # Create System Message Template
-        system_template = "You are a cybersecurity expert. Your task is to produce a comprehensive incident response testing scenario based on the information provided."
-        system_message_prompt = SystemMessagePromptTemplate.from_template(system_template)
-
-        # Create Human Message Template
-        human_template = ("""
-**Background information:**
-The company operates in the '{industry}' industry and is of size '{company_size}'.
-
-**Threat actor information:**
-{template_info}
-The threat actor is known to use the following ATT&CK techniques:
-{selected_techniques_string}
-
-**Your task:**
-Create a custom incident response testing scenario based on the information provided. The goal of the scenario is to test the company's incident response capabilities against a threat actor group that uses the identified ATT&CK techniques. 
-
-Your response should be well structured and formatted using Markdown.
-""")
-        human_message_prompt = HumanMessagePromptTemplate.from_template(human_template)
-
-        # Construct the ChatPromptTemplate
-        chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-
-        # Format the prompt
-        messages = chat_prompt.format_prompt(selected_techniques_string=selected_techniques_string, 
-                                            industry=industry, 
-                                            company_size=company_size,
-                                            template_info=template_info).to_messages()
+        messages = build_scenario_messages(selected_techniques, selected_template)
 except Exception as e:
     st.error("An error occurred: " + str(e))
 
@@ -452,238 +805,64 @@ st.markdown("""
             """)
 try:
         if model_provider == "Azure OpenAI Service":
-            if st.button('Generate Scenario', key='generate_custom_scenario_azure'):
-                if not os.environ["AZURE_OPENAI_API_KEY"]:
-                    st.info("Please add your Azure OpenAI Service API key to continue.")
-                if not os.environ["AZURE_OPENAI_ENDPOINT"]:
-                    st.info("Please add your Azure OpenAI Service API endpoint to continue.")
-                if not os.environ["AZURE_DEPLOYMENT"]:
-                    st.info("Please add the name of your Azure OpenAI Service Deployment to continue.")
-                elif not industry:
-                    st.info("Please select your company's industry to continue.")
-                elif not company_size:
-                    st.info("Please select your company's size to continue.")
-                else:
-                        response = generate_scenario_azure_wrapper(messages)
-                        st.markdown("---")
-                        if response is not None:
-                            st.session_state['custom_scenario_generated'] = True
-                            custom_scenario_text = response.choices[0].message.content
-                            st.session_state['custom_scenario_text'] = custom_scenario_text  # Store the generated scenario in the session state
-                            st.markdown(custom_scenario_text)
-                            st.download_button(label="Download Scenario", data=st.session_state['custom_scenario_text'], file_name="custom_scenario.md", mime="text/markdown")
-
-                            st.session_state['last_scenario'] = True
-                            st.session_state['last_scenario_text'] = custom_scenario_text # Store the last scenario in the session state for use by the Scenario Assistant
-
-                        else:
-                            # If a scenario has been generated previously, display it
-                            if 'custom_scenario_text' in st.session_state and st.session_state['custom_scenario_generated']:
-                                st.markdown("---")
-                                st.markdown(st.session_state['custom_scenario_text'])
-                                st.download_button(label="Download Scenario", data=st.session_state['custom_scenario_text'], file_name="custom_scenario.md", mime="text/markdown")
+            render_generate_flow('generate_custom_scenario_azure',
+                                 os.getenv('AZURE_DEPLOYMENT'),
+                                 lambda: generate_scenario_azure_wrapper(messages))
 
         elif model_provider == "Google AI API":
-            if st.button('Generate Scenario', key='generate_custom_scenario_google'):
-                if not os.environ["GOOGLE_API_KEY"]:
-                    st.info("Please add your Google AI API key to continue.")
-                if not os.environ["GOOGLE_MODEL"]:
-                    st.info("Please select a model to continue.")
-                elif not industry:
-                    st.info("Please select your company's industry to continue.")
-                elif not company_size:
-                    st.info("Please select your company's size to continue.")
-                else:
-                    google_api_key = st.session_state.get('google_api_key')
-                    model_name = os.getenv('GOOGLE_MODEL')
-                    response = generate_scenario_google_wrapper(google_api_key, model_name, messages)
-                    st.markdown("---")
-                    if response is not None:
-                        st.session_state['custom_scenario_generated'] = True
-                        custom_scenario_text = response.content
-                        st.session_state['custom_scenario_text'] = custom_scenario_text  # Store the generated scenario in the session state
-                        st.markdown(custom_scenario_text)
-                        st.download_button(label="Download Scenario", data=st.session_state['custom_scenario_text'], file_name="custom_scenario.md", mime="text/markdown")
-
-                        st.session_state['last_scenario'] = True
-                        st.session_state['last_scenario_text'] = custom_scenario_text # Store the last scenario in the session state for use by the Scenario Assistant
-
-                    else:
-                        # If a scenario has been generated previously, display it
-                        if 'custom_scenario_text' in st.session_state and st.session_state['custom_scenario_generated']:
-                            st.markdown("---")
-                            st.markdown(st.session_state['custom_scenario_text'])
-                            st.download_button(label="Download Scenario", data=st.session_state['custom_scenario_text'], file_name="custom_scenario.md", mime="text/markdown")
+            google_api_key = os.getenv('GOOGLE_API_KEY')
+            model_name = os.getenv('GOOGLE_MODEL')
+            render_generate_flow('generate_custom_scenario_google',
+                                 model_name,
+                                 lambda: generate_scenario_google_wrapper(google_api_key, model_name, messages))
 
         elif model_provider == "Mistral API":
-            if st.button('Generate Scenario', key='generate_custom_scenario_mistral'):
-                if not os.environ["MISTRAL_API_KEY"]:
-                    st.info("Please add your Mistral API key to continue.")
-                if not os.environ["MISTRAL_MODEL"]:
-                    st.info("Please select a model to continue.")
-                elif not industry:
-                    st.info("Please select your company's industry to continue.")
-                elif not company_size:
-                    st.info("Please select your company's size to continue.")
-                else:
-                    mistral_api_key = st.session_state.get('mistral_api_key')
-                    model_name = os.getenv('MISTRAL_MODEL')
-                    response = generate_scenario_mistral_wrapper(mistral_api_key, model_name, messages)
-                    st.markdown("---")
-                    if response is not None:
-                        st.session_state['custom_scenario_generated'] = True
-                        custom_scenario_text = response.content
-                        st.session_state['custom_scenario_text'] = custom_scenario_text  # Store the generated scenario in the session state
-                        st.markdown(custom_scenario_text)
-                        st.download_button(label="Download Scenario", data=st.session_state['custom_scenario_text'], file_name="custom_scenario.md", mime="text/markdown")
-
-                        st.session_state['last_scenario'] = True
-                        st.session_state['last_scenario_text'] = custom_scenario_text # Store the last scenario in the session state for use by the Scenario Assistant
+            mistral_api_key = os.getenv('MISTRAL_API_KEY')
+            model_name = os.getenv('MISTRAL_MODEL')
+            render_generate_flow('generate_custom_scenario_mistral',
+                                 model_name,
+                                 lambda: generate_scenario_mistral_wrapper(mistral_api_key, model_name, messages))
 
-                    else:
-                        # If a scenario has been generated previously, display it
-                        if 'custom_scenario_text' in st.session_state and st.session_state['custom_scenario_generated']:
-                            st.markdown("---")
-                            st.markdown(st.session_state['custom_scenario_text'])
-                            st.download_button(label="Download Scenario", data=st.session_state['custom_scenario_text'], file_name="custom_scenario.md", mime="text/markdown")
-        
         elif model_provider == "Ollama":
-            if st.button('Generate Scenario', key='generate_custom_scenario_ollama'):
-                if not os.environ["OLLAMA_MODEL"]:
-                    st.info("Please select a model to continue.")
-                elif not industry:
-                    st.info("Please select your company's industry to continue.")
-                elif not company_size:
-                    st.info("Please select your company's size to continue.")
-                else:
-                    model = os.getenv('OLLAMA_MODEL')
-                    response = generate_scenario_ollama_wrapper(model)
-                    st.markdown("---")
-                    if response is not None:
-                        st.session_state['custom_scenario_generated'] = True
-                        custom_scenario_text = response
-                        st.session_state['custom_scenario_text'] = custom_scenario_text  # Store the generated scenario in the session state
-                        st.markdown(custom_scenario_text)
-                        st.download_button(label="Download Scenario", data=st.session_state['custom_scenario_text'], file_name="custom_scenario.md", mime="text/markdown")
-
-                        st.session_state['last_scenario'] = True
-                        st.session_state['last_scenario_text'] = custom_scenario_text # Store the last scenario in the session state for use by the Scenario Assistant
+            render_generate_flow('generate_custom_scenario_ollama',
+                                 OLLAMA_MODEL,
+                                 lambda: generate_scenario_ollama_wrapper(OLLAMA_MODEL, messages))
 
-                    else:
-                        # If a scenario has been generated previously, display it
-                        if 'custom_scenario_text' in st.session_state and st.session_state['custom_scenario_generated']:
-                            st.markdown("---")
-                            st.markdown(st.session_state['custom_scenario_text'])
-                            st.download_button(label="Download Scenario", data=st.session_state['custom_scenario_text'], file_name="custom_scenario.md", mime="text/markdown")
         else:
-            if st.button('Generate Scenario', key="generate_custom_scenario"):
-                openai_api_key = st.session_state.get('openai_api_key')
-                model_name = st.session_state.get('model_name')
-                if not openai_api_key:
-                    st.info("Please add your OpenAI API key to continue.")
-                if not model_name:
-                    st.info("Please select a model to continue.")
-                elif not industry:
-                    st.info("Please select your company's industry to continue.")
-                elif not company_size:
-                    st.info("Please select your company's size to continue.")
-                else:
-                    # Generate a scenario
-                    response = generate_scenario_wrapper(openai_api_key, model_name, messages)
-                    st.markdown("---")
-                    if response is not None:
-                        st.session_state['custom_scenario_generated'] = True
-                        custom_scenario_text = response.generations[0][0].text
-                        st.session_state['custom_scenario_text'] = custom_scenario_text  # Store the generated scenario in the session state
-                        st.markdown(custom_scenario_text)
-                        st.download_button(label="Download Scenario", data=custom_scenario_text, file_name="custom_scenario.md", mime="text/markdown")
-
-                        st.session_state['last_scenario'] = True
-                        st.session_state['last_scenario_text'] = custom_scenario_text # Store the last scenario in the session state for use by the Scenario Assistant
-            else:
-                # If a scenario has been generated previously, display it
-                if 'custom_scenario_text' in st.session_state and st.session_state['custom_scenario_generated']:
-                    st.markdown("---")
-                    st.markdown(st.session_state['custom_scenario_text'])
-                    st.download_button(label="Download Scenario", data=st.session_state['custom_scenario_text'], file_name="custom_scenario.md", mime="text/markdown")
+            openai_api_key = st.session_state.get('openai_api_key')
+            model_name = st.session_state.get('model_name')
+            render_generate_flow("generate_custom_scenario",
+                                 model_name,
+                                 lambda: generate_scenario_wrapper(openai_api_key, model_name, messages))
         
         # Display an info message if no API key is set
-        if 'LANGCHAIN_API_KEY' not in st.secrets:
+        if not api_key:
             st.info("ℹ️ No LangChain API key has been set. This run will not be logged to LangSmith.")             
 
-        # Create a placeholder for the feedback message
-        feedback_placeholder = st.empty()
-
-        # Show the thumbs_up and thumbs_down buttons only when a scenario has been generated
-        st.markdown("---")
-        # Ensure the condition checks if 'custom_scenario_generated' is True and client is initialized
-        if st.session_state.get('custom_scenario_generated', False) and client is not None:
-            st.markdown("Rate the scenario to help improve this tool.")
-            col1, col2, col3 = st.columns([0.5, 0.5, 5])
-            with col1:
-                thumbs_up = st.button("👍", key="thumbs_up_custom")
-                if thumbs_up:
-                    try:
-                        run_id = st.session_state.get('run_id')
-                        if run_id:
-                            feedback_type_str = "positive"
-                            score = 1  # or 0
-                            comment = ""
-
-                            # Record the feedback
-                            feedback_record = client.create_feedback(
-                                run_id,
-                                feedback_type_str,
-                                score=score,
-                                comment=comment,
-                            )
-                            st.session_state.feedback = {
-                                "feedback_id": str(feedback_record.id),
-                                "score": score,
-                            }
-                            # Update the feedback message in the placeholder
-                            feedback_placeholder.success("Feedback submitted. Thank you.")
-                        else:
-                            # Update the feedback message in the placeholder
-                            feedback_placeholder.warning("No run ID found. Please generate a scenario first.")
-                    except Exception as e:
-                        # Update the feedback message in the placeholder
-                        feedback_placeholder.error(f"An error occurred while creating feedback: {str(e)}")
-
-            with col2:
-                thumbs_down = st.button("👎")
-                if thumbs_down:
-                    try:
-                        run_id = st.session_state.get('run_id')
-                        if run_id:
-                            feedback_type_str = "negative"
-                            score = 0  # or 0
-                            comment = ""
-
-                            # Record the feedback
-                            feedback_record = client.create_feedback(
-                                run_id,
-                                feedback_type_str,
-                                score=score,
-                                comment=comment,
-                            )
-                            st.session_state.feedback = {
-                                "feedback_id": str(feedback_record.id),
-                                "score": score,
-                            }
-                            # Update the feedback message in the placeholder
-                            feedback_placeholder.success("Feedback submitted. Thank you.")
-                        else:
-                            # Update the feedback message in the placeholder
-                            feedback_placeholder.warning("No run ID found. Please generate a scenario first.")
-                    except Exception as e:
-                        # Update the feedback message in the placeholder
-                        feedback_placeholder.error(f"An error occurred while creating feedback: {str(e)}")
+        # Read the feedback state once, after any generation in this run has updated it
+        ss = st.session_state
+        _feedback_ui(ss.get('run_id'), ss.get('custom_scenario_generated', False))
                 
                 
 except Exception as e:
     st.error("An error occurred: " + str(e))
     
+st.markdown("")
+
+# Display the template batch generation section
+st.markdown("""
+            ### Generate All Templates
+
+            Click the button below to generate a scenario for every template at once. Scenarios are generated concurrently and each one is displayed as soon as it is ready.
+            """)
+if st.button('Generate All Templates', key='generate_all_templates'):
+    if validate_generation_inputs(provider_settings()):
+        named_messages = [(template, build_scenario_messages(resolve_template_techniques(template), template)) for template in incident_response_templates]
+        st.session_state['template_scenarios'] = run_async(generate_template_scenarios(named_messages))
+elif 'template_scenarios' in st.session_state:
+    # If template scenarios have been generated previously, display them
+    for template, scenario_text in st.session_state['template_scenarios'].items():
+        show_template_scenario(template, scenario_text)
 
 # Add a back button
 link_to_homepage = "/"
@@ -0,0 +1,34 @@
+import orjson
+
+# Build the minimal techniques index used by the Custom Scenarios page from the MITRE ATT&CK STIX data.
+# Re-run this script from the repository root whenever the STIX files in ./data/ are updated:
+#   python scripts/build_techniques_index.py
+
+ATTACK_DATA_PATHS = ["./data/enterprise-attack.json", "./data/ics-attack.json"]
+TECHNIQUES_INDEX_PATH = "./data/techniques_min.json"
+
+def load_techniques(path):
+    with open(path, "rb") as f:
+        bundle = orjson.loads(f.read())
+    # Techniques are stored as STIX attack-pattern objects
+    return [obj for obj in bundle["objects"] if obj["type"] == "attack-pattern"]
+
+def build_techniques_index():
+    records = []
+    for path in ATTACK_DATA_PATHS:
+        for technique in load_techniques(path):
+            for reference in technique.get("external_references", []):
+                if "external_id" in reference:
+                    records.append({
+                        'id': technique["id"],
+                        'Technique Name': technique["name"],
+                        'External ID': reference['external_id'],
+                        'Display Name': f"{technique['name']} ({reference['external_id']})"
+                    })
+    return records
+
+if __name__ == "__main__":
+    records = build_techniques_index()
+    with open(TECHNIQUES_INDEX_PATH, "wb") as f:
+        f.write(orjson.dumps(records))
+    print(f"Wrote {len(records)} techniques to {TECHNIQUES_INDEX_PATH}")
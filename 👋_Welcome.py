@@ -131,7 +131,7 @@ with st.sidebar:
             )
             st.session_state["ollama_model"] = ollama_model
 
-    st.markdown("""---""")
+    st.divider()
 
     # Add the drop-down selectors for Industry and Company Size
     industry = st.selectbox(
@@ -153,7 +153,7 @@ with st.sidebar:
     company_size = st.selectbox("Select your company's size:", ['Small (1-50 employees)', 'Medium (51-200 employees)', 'Large (201-1,000 employees)', 'Enterprise (1,001-10,000 employees)', 'Large Enterprise (10,000+ employees)'], placeholder="Select Company Size")
     st.session_state["company_size"] = company_size
 
-    st.sidebar.markdown("---")
+    st.sidebar.divider()
 
     st.sidebar.markdown("### <span style='color: #1DB954;'>About</span>", unsafe_allow_html=True)        
     
@@ -167,7 +167,7 @@ with st.sidebar:
 
 st.markdown("# <span style='color: #1DB954;'>Response GPT 👾</span>", unsafe_allow_html=True)
 st.markdown("<span style='color: #1DB954;'> **Combine the MITRE ATT&CK and Large Language Models to generate a tailored incident response scenario for Enterprise, Mobile and Industrial Control Systems (ICS).**</span>", unsafe_allow_html=True)
-st.markdown("---")
+st.divider()
 
 st.markdown("""          
             ### Welcome to Response GPT!